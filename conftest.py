@@ -0,0 +1,20 @@
+def pytest_configure(config):
+    """Shard by test class when run in parallel with pytest-xdist (`pytest -n auto`).
+
+    Tests in a class share one in-memory database opened in setUpClass, so
+    splitting a class across workers would only repeat that setup.
+    """
+    if getattr(config.option, 'dist', 'no') == 'load':
+        config.option.dist = 'loadscope'
+
+
+def pytest_sessionstart(session):
+    """Keep test runs from writing sync's rotating log file.
+
+    RotatingFileHandler isn't process-safe, and xdist workers would all
+    append to and roll over the same shopify_sync.log in the working
+    directory. Records still reach pytest's log capture.
+    """
+    import sync
+    sync.logger.removeHandler(sync.file_handler)
+    sync.file_handler.close()
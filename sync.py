@@ -1,19 +1,36 @@
 import os
+import json
+import time
+import queue
+import urllib.request
 import shopify
 import sqlite3
-from datetime import datetime
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from itertools import islice
+from typing import List, Dict, Any, Callable, Iterable, Iterator, NamedTuple, Optional
 from flask import Flask, jsonify
 import threading
 import logging
 from logging.handlers import RotatingFileHandler
+from pyactiveresource import formats
+from pyactiveresource.connection import ClientError
+
+try:
+    import orjson
+except ImportError:  # optional; stdlib json is used when it's missing
+    orjson = None
+
+_json_loads = orjson.loads if orjson else json.loads
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Add file handler for persistent logs
-file_handler = RotatingFileHandler('shopify_sync.log', maxBytes=1024*1024, backupCount=5)
+# Add file handler for persistent logs; the file is only opened on the first
+# record, so importing the module doesn't create it
+file_handler = RotatingFileHandler('shopify_sync.log', maxBytes=1024*1024, backupCount=5, delay=True)
 file_handler.setFormatter(logging.Formatter(
     '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 ))
@@ -21,63 +38,433 @@ logger.addHandler(file_handler)
 
 app = Flask(__name__)
 
+@dataclass(frozen=True)
+class ShopifyConfig:
+    """Shopify credentials and sync options, read from the environment."""
+    shop_url: Optional[str]
+    access_token: Optional[str]
+    api_key: Optional[str] = None
+    api_secret: Optional[str] = None
+    bulk_sync: bool = False
+
+    @classmethod
+    def from_env(cls) -> 'ShopifyConfig':
+        return cls(
+            shop_url=os.getenv('SHOPIFY_SHOP_URL'),
+            access_token=os.getenv('SHOPIFY_ACCESS_TOKEN'),
+            api_key=os.getenv('SHOPIFY_API_KEY'),
+            api_secret=os.getenv('SHOPIFY_API_SECRET'),
+            bulk_sync=os.getenv('SHOPIFY_BULK_SYNC', '').strip().lower() in ('1', 'true', 'yes', 'on')
+        )
+
+# Read once at import; restart the service to pick up new credentials
+CONFIG = ShopifyConfig.from_env()
+
+# Database connection shared by all sync runs; see get_db_connection
+_db_conn = None
+_db_init_lock = threading.Lock()
+_db_write_lock = threading.Lock()
+
+# Sync requests waiting for the background worker. At most one waits while
+# another runs, so repeated POSTs can't start parallel Shopify crawls.
+_sync_queue = queue.Queue(maxsize=1)
+_sync_worker = None
+_sync_worker_lock = threading.Lock()
+
+# Schema and statements are module constants so each is compiled once and
+# sqlite3's statement cache keeps hitting the same SQL string
+# Timestamps are stored as integer Unix seconds: smaller rows than ISO text
+# and no per-row datetime adapter when binding parameters
+PRODUCTS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY,
+        title TEXT,
+        description TEXT,
+        vendor TEXT,
+        product_type TEXT,
+        created_at INTEGER,
+        updated_at INTEGER,
+        published_at INTEGER,
+        status TEXT,
+        price REAL,
+        compare_at_price REAL,
+        sku TEXT,
+        inventory_quantity INTEGER,
+        last_synced_at INTEGER
+    )
+'''
+
+CREATE_PRODUCTS_SQL = PRODUCTS_TABLE_SQL.format(table='main.products')
+
+# Single-row table holding the incremental sync checkpoint
+CREATE_SYNC_STATE_SQL = '''
+    CREATE TABLE IF NOT EXISTS sync_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        last_updated_at TIMESTAMP
+    )
+'''
+
+# Incremental syncs and "changed since" lookups filter on updated_at, so
+# this index is part of the schema from the start rather than deferred
+CREATE_UPDATED_AT_INDEX_SQL = 'CREATE INDEX IF NOT EXISTS ix_products_updated_at ON products(updated_at)'
+
+# Secondary indexes for lookups on the synced catalog. They are built after
+# the products are written: one pass over a loaded table is much cheaper
+# than maintaining every B-tree row by row during the first bulk insert.
+CREATE_PRODUCT_INDEXES_SQL = (
+    'CREATE INDEX IF NOT EXISTS ix_products_vendor ON products(vendor)',
+    'CREATE INDEX IF NOT EXISTS ix_products_product_type ON products(product_type)',
+    'CREATE INDEX IF NOT EXISTS ix_products_sku ON products(sku)'
+)
+
+class ProductRow(NamedTuple):
+    """One products row. Being a tuple, it binds straight to executemany."""
+    id: Optional[int]
+    title: Optional[str]
+    description: Optional[str]
+    vendor: Optional[str]
+    product_type: Optional[str]
+    created_at: Optional[int]
+    updated_at: Optional[int]
+    published_at: Optional[int]
+    status: Optional[str]
+    price: Optional[float]
+    compare_at_price: Optional[float]
+    sku: Optional[str]
+    inventory_quantity: Optional[int]
+    last_synced_at: int
+
+# Column order shared by the products table and the rows we insert into it
+PRODUCT_COLUMNS = ProductRow._fields
+
+# A sync first stages its rows in an attached in-memory database, then
+# copies them into the real table with one INSERT ... SELECT. The staging
+# table has the same columns in the same order, and replacing on conflict
+# there drops any product Shopify returned twice.
+CREATE_STAGED_PRODUCTS_SQL = PRODUCTS_TABLE_SQL.format(table='stage.products')
+
+STAGE_PRODUCT_SQL = '''
+    INSERT OR REPLACE INTO stage.products (
+        id, title, description, vendor, product_type,
+        created_at, updated_at, published_at, status,
+        price, compare_at_price, sku, inventory_quantity,
+        last_synced_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+COPY_STAGED_PRODUCTS_SQL = '''
+    INSERT INTO main.products SELECT * FROM stage.products
+'''
+
+# Incremental syncs update stored products in place, and only when Shopify
+# reports a newer updated_at, so unchanged products cost no page writes.
+# The WHERE true keeps SQLite from parsing ON CONFLICT as a join clause.
+MERGE_STAGED_PRODUCTS_SQL = '''
+    INSERT INTO main.products SELECT * FROM stage.products WHERE true
+    ON CONFLICT(id) DO UPDATE SET
+        title = excluded.title,
+        description = excluded.description,
+        vendor = excluded.vendor,
+        product_type = excluded.product_type,
+        created_at = excluded.created_at,
+        updated_at = excluded.updated_at,
+        published_at = excluded.published_at,
+        status = excluded.status,
+        price = excluded.price,
+        compare_at_price = excluded.compare_at_price,
+        sku = excluded.sku,
+        inventory_quantity = excluded.inventory_quantity,
+        last_synced_at = excluded.last_synced_at
+    WHERE products.updated_at IS NOT excluded.updated_at
+'''
+
+# Shopify REST paging. Pages are walked with a since_id cursor, so each
+# request is an index seek on id rather than an ever-deeper offset scan;
+# 429s are retried with backoff.
+PAGE_SIZE = 250
+FETCH_MAX_RETRIES = 5
+
+# GraphQL bulk export of the catalog, used when SHOPIFY_BULK_SYNC is set.
+# The %s slot takes an optional products() search argument.
+BULK_PRODUCTS_QUERY = '''
+{
+  products%s {
+    edges {
+      node {
+        id title bodyHtml vendor productType createdAt updatedAt publishedAt status
+        variants {
+          edges { node { price compareAtPrice sku inventoryQuantity } }
+        }
+      }
+    }
+  }
+}
+'''
+
+BULK_RUN_MUTATION = '''
+mutation($query: String!) {
+  bulkOperationRunQuery(query: $query) {
+    bulkOperation { id status }
+    userErrors { field message }
+  }
+}
+'''
+
+CURRENT_BULK_OPERATION_QUERY = '{ currentBulkOperation { id status errorCode url } }'
+
+BULK_CANCEL_MUTATION = '''
+mutation bulkOperationCancel($id: ID!) {
+  bulkOperationCancel(id: $id) {
+    userErrors { field message }
+  }
+}
+'''
+
+BULK_POLL_INTERVAL = 3  # seconds
+# The sync worker is single-threaded, so a bulk operation that never
+# finishes or a stalled download must not hold it forever
+BULK_MAX_WAIT = 30 * 60  # seconds
+BULK_DOWNLOAD_TIMEOUT = 60  # seconds without data before the download fails
+
+# Rows transformed and bound per executemany call while staging a sync.
+# This only bounds the Python-side list of rows; the staging table itself
+# holds every row of the sync until the final copy (see sync_rows_to_db).
+SYNC_BATCH_SIZE = 1_000
+
+def _orjson_decode(resource_string: bytes) -> Any:
+    """Drop-in for JSONFormat.decode that parses with orjson."""
+    try:
+        data = orjson.loads(resource_string)
+    except ValueError as err:
+        raise formats.Error(err)
+    return formats.remove_root(data)
+
 # Initialize Shopify API
-def init_shopify(shop_url: str, access_token: str) -> None:
-    """Initialize the Shopify API client."""
+def init_shopify(shop_url: str, access_token: str,
+                 client_factory: Callable[[str, str, str], shopify.Session] = shopify.Session) -> None:
+    """
+    Initialize the Shopify API client.
+    
+    Args:
+        shop_url (str): The shop's myshopify.com domain
+        access_token (str): Admin API access token
+        client_factory (callable): Builds the session from (shop_url,
+            api_version, access_token); tests can pass their own
+    """
     try:
-        shopify.Session.setup(api_key=os.getenv('SHOPIFY_API_KEY'), secret=os.getenv('SHOPIFY_API_SECRET'))
-        session = shopify.Session(shop_url, '2024-01', access_token)
+        # Decode REST responses with orjson when it's installed
+        if orjson:
+            formats.JSONFormat.decode = staticmethod(_orjson_decode)
+        
+        shopify.Session.setup(api_key=CONFIG.api_key, secret=CONFIG.api_secret)
+        session = client_factory(shop_url, '2024-01', access_token)
         shopify.ShopifyResource.activate_session(session)
         logger.info(f"Successfully initialized Shopify API for shop: {shop_url}")
     except Exception as e:
         logger.error(f"Failed to initialize Shopify API: {str(e)}")
         raise
 
-def get_all_products() -> List[Dict[Any, Any]]:
-    """Fetch all products from Shopify."""
-    products = []
-    page = 1
+def _share_shopify_headers(headers: Dict[str, str]) -> None:
+    """Copy the activating thread's auth headers into a worker thread.
+
+    ShopifyResource keeps request headers (including the access token) in
+    thread-local storage, so pool threads start without them.
+    """
+    shopify.ShopifyResource.headers = dict(headers)
+
+def _fetch_products_page(since_id: int, filters: Dict[str, Any]) -> List[Dict[Any, Any]]:
+    """
+    Fetch the page of products after since_id as plain dicts, backing off on 429s.
+    
+    Resources are flattened with to_dict() once here, so the transform loop
+    works on dict lookups instead of ActiveResource attribute dispatch.
+    """
+    for attempt in range(FETCH_MAX_RETRIES + 1):
+        try:
+            return [product.to_dict() for product in shopify.Product.find(limit=PAGE_SIZE, since_id=since_id, **filters)]
+        except ClientError as e:
+            if e.code != 429 or attempt == FETCH_MAX_RETRIES:
+                raise
+            retry_after = e.response.get('Retry-After')
+            delay = float(retry_after) if retry_after else 2 ** attempt
+            logger.warning(f"Rate limited on products after id {since_id}, retrying in {delay}s")
+            time.sleep(delay)
+
+def iter_product_pages(updated_at_min: Optional[str] = None) -> Iterator[List[Dict[Any, Any]]]:
+    """
+    Yield pages of products from Shopify in id order, fetching one ahead.
     
+    Shopify returns products ordered by id when since_id is given, so the
+    last id of each page is the cursor for the next. Offset (page=N) paging
+    makes Shopify skip every earlier row on each request and is rate limited
+    harder. The next page is requested as soon as the current one arrives,
+    so a caller writing pages to the database overlaps those writes with
+    the following download.
+    
+    Args:
+        updated_at_min (str): Only fetch products updated at or after this
+            ISO 8601 time; fetches the whole catalog when omitted
+    """
+    filters = {'updated_at_min': updated_at_min} if updated_at_min else {}
+    
+    executor = ThreadPoolExecutor(
+        max_workers=1,
+        initializer=_share_shopify_headers,
+        initargs=(shopify.ShopifyResource.headers,)
+    )
     try:
-        while True:
-            logger.info(f"Fetching products page {page}")
-            batch = shopify.Product.find(limit=250, page=page)
+        since_id = 0
+        future = executor.submit(_fetch_products_page, since_id, filters)
+        while future:
+            batch = future.result()
             if not batch:
                 break
-                
-            products.extend(batch)
-            logger.info(f"Retrieved {len(batch)} products from page {page}")
-            page += 1
+            # A short page is the last one; otherwise start on the next
+            # before handing this page to the caller
+            future = None
+            if len(batch) == PAGE_SIZE:
+                future = executor.submit(_fetch_products_page, batch[-1]['id'], filters)
             
-        logger.info(f"Successfully fetched total {len(products)} products")
-        return products
+            logger.info("Retrieved %d products after id %d", len(batch), since_id)
+            since_id = batch[-1]['id']
+            yield batch
+    finally:
+        # Don't download a page nobody will read if the caller stops early
+        executor.shutdown(cancel_futures=True)
+
+def get_all_products(updated_at_min: Optional[str] = None) -> Iterator[Dict[Any, Any]]:
+    """
+    Stream all products from Shopify.
+    
+    Products are yielded page by page as they download, so the fetch itself
+    holds only the current and next page. Note that sync_products_to_db
+    stages everything it is given in memory before writing it to disk.
+    
+    Args:
+        updated_at_min (str): Only fetch products updated at or after this
+            ISO 8601 time; fetches the whole catalog when omitted
+    """
+    fetched = 0
+    
+    try:
+        for batch in iter_product_pages(updated_at_min):
+            fetched += len(batch)
+            yield from batch
+            
+        logger.info(f"Successfully fetched total {fetched} products")
     except Exception as e:
         logger.error(f"Error fetching products: {str(e)}")
         raise
 
+def _graphql(query: str, variables: Dict[str, Any] = None) -> Dict[str, Any]:
+    """Run a GraphQL Admin API request and return its data payload."""
+    response = _json_loads(shopify.GraphQL().execute(query, variables))
+    if response.get('errors'):
+        raise Exception(f"GraphQL request failed: {response['errors']}")
+    return response['data']
+
+def _bulk_node_to_product(node: Dict[str, Any]) -> Dict[str, Any]:
+    """Reshape a bulk-operation product node into the REST product layout."""
+    return {
+        'id': int(node['id'].rsplit('/', 1)[-1]),
+        'title': node.get('title'),
+        'body_html': node.get('bodyHtml'),
+        'vendor': node.get('vendor'),
+        'product_type': node.get('productType'),
+        'created_at': node.get('createdAt'),
+        'updated_at': node.get('updatedAt'),
+        'published_at': node.get('publishedAt'),
+        'status': node['status'].lower() if node.get('status') else None,
+        'variants': []
+    }
+
+def get_all_products_bulk(updated_at_min: Optional[str] = None) -> List[Dict[Any, Any]]:
+    """
+    Fetch all products from Shopify with a single GraphQL bulk operation.
+    
+    Shopify runs the query server-side and publishes the result as one JSONL
+    file, so the whole catalog costs one mutation, a few status polls and a
+    single download instead of one REST request per page.
+    
+    Args:
+        updated_at_min (str): Only fetch products updated at or after this
+            ISO 8601 time; fetches the whole catalog when omitted
+    
+    Returns:
+        List of product dicts in the same layout as the REST API returns
+    """
+    try:
+        search = f'(query: "updated_at:>=\'{updated_at_min}\'")' if updated_at_min else ''
+        data = _graphql(BULK_RUN_MUTATION, {'query': BULK_PRODUCTS_QUERY % search})['bulkOperationRunQuery']
+        if data['userErrors']:
+            raise Exception(f"Bulk operation rejected: {data['userErrors']}")
+        operation_id = data['bulkOperation']['id']
+        logger.info(f"Started bulk operation {operation_id}")
+        
+        deadline = time.monotonic() + BULK_MAX_WAIT
+        while True:
+            time.sleep(BULK_POLL_INTERVAL)
+            operation = _graphql(CURRENT_BULK_OPERATION_QUERY)['currentBulkOperation']
+            if operation['status'] not in ('CREATED', 'RUNNING'):
+                break
+            if time.monotonic() >= deadline:
+                # Shopify runs one bulk query per shop at a time, so don't
+                # leave this one blocking the next sync
+                _graphql(BULK_CANCEL_MUTATION, {'id': operation_id})
+                raise TimeoutError(f"Bulk operation {operation_id} still {operation['status']} after {BULK_MAX_WAIT}s; cancelled")
+        
+        if operation['status'] != 'COMPLETED':
+            raise Exception(f"Bulk operation {operation['id']} ended with status {operation['status']}: {operation['errorCode']}")
+        
+        products = []
+        # Shopify returns no URL when the query matched nothing
+        if operation['url']:
+            by_gid = {}
+            with urllib.request.urlopen(operation['url'], timeout=BULK_DOWNLOAD_TIMEOUT) as response:
+                for line in response:
+                    record = _json_loads(line)
+                    # Nested connections are flattened into their own lines,
+                    # each pointing back at the product it belongs to
+                    parent_gid = record.pop('__parentId', None)
+                    if parent_gid is None:
+                        product = _bulk_node_to_product(record)
+                        by_gid[record['id']] = product
+                        products.append(product)
+                    else:
+                        by_gid[parent_gid]['variants'].append({
+                            'price': record.get('price'),
+                            'compare_at_price': record.get('compareAtPrice'),
+                            'sku': record.get('sku'),
+                            'inventory_quantity': record.get('inventoryQuantity')
+                        })
+        
+        logger.info(f"Successfully fetched total {len(products)} products via bulk operation")
+        return products
+    except Exception as e:
+        logger.error(f"Error fetching products via bulk operation: {str(e)}")
+        raise
+
 def init_db(db_path: str = 'shopify_products.db') -> sqlite3.Connection:
     """Initialize SQLite database and create products table if it doesn't exist."""
     try:
-        conn = sqlite3.connect(db_path)
+        # Autocommit mode: transactions are opened explicitly by the writers.
+        # The connection is shared between sync threads, which serialize
+        # their writes themselves.
+        conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
         cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY,
-                title TEXT,
-                description TEXT,
-                vendor TEXT,
-                product_type TEXT,
-                created_at TIMESTAMP,
-                updated_at TIMESTAMP,
-                published_at TIMESTAMP,
-                status TEXT,
-                price REAL,
-                compare_at_price REAL,
-                sku TEXT,
-                inventory_quantity INTEGER,
-                last_synced_at TIMESTAMP
-            )
+
+        # WAL lets readers proceed while the sync writes, and NORMAL sync
+        # only fsyncs at checkpoints instead of on every commit.
+        # Settings and schema go to SQLite as one script in a single call.
+        cursor.executescript(f'''
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-65536;  -- 64 MB
+            PRAGMA busy_timeout=5000;
+            {CREATE_PRODUCTS_SQL};
+            {CREATE_SYNC_STATE_SQL};
+            {CREATE_UPDATED_AT_INDEX_SQL};
         ''')
         
         conn.commit()
@@ -87,94 +474,171 @@ def init_db(db_path: str = 'shopify_products.db') -> sqlite3.Connection:
         logger.error(f"Failed to initialize database: {str(e)}")
         raise
 
-def transform_product_data(product: Dict[Any, Any]) -> Dict[str, Any]:
+def _to_epoch(timestamp: Optional[str]) -> Optional[int]:
+    """Convert a Shopify ISO 8601 timestamp to Unix seconds."""
+    if not timestamp:
+        return None
+    # fromisoformat() only accepts a trailing Z from Python 3.11 on
+    return int(datetime.fromisoformat(timestamp.replace('Z', '+00:00')).timestamp())
+
+def transform_product_data(product: Dict[Any, Any], synced_at: Optional[int] = None) -> ProductRow:
     """
     Transform Shopify product data to match our database schema.
     
     Args:
         product (Dict): Raw Shopify product data
+        synced_at (int): Sync time to record in Unix seconds; defaults to now
         
     Returns:
-        Dict containing transformed data matching our schema
+        ProductRow with the product's values in PRODUCT_COLUMNS order
+    
+    Raises whatever a malformed product trips over; callers decide whether
+    to log and skip it.
     """
+    # Get the first variant for price and inventory information
+    variants = product.get('variants')
+    variant = variants[0] if variants else {}
+    price = variant.get('price')
+    compare_at_price = variant.get('compare_at_price')
+    
+    return ProductRow(
+        id=product.get('id'),
+        title=product.get('title'),
+        description=product.get('body_html'),
+        vendor=product.get('vendor'),
+        product_type=product.get('product_type'),
+        created_at=_to_epoch(product.get('created_at')),
+        updated_at=_to_epoch(product.get('updated_at')),
+        published_at=_to_epoch(product.get('published_at')),
+        status=product.get('status'),
+        price=float(price) if price else None,
+        compare_at_price=float(compare_at_price) if compare_at_price else None,
+        sku=variant.get('sku'),
+        inventory_quantity=variant.get('inventory_quantity'),
+        last_synced_at=synced_at if synced_at is not None else int(time.time())
+    )
+
+def sync_rows_to_db(rows: Iterable[tuple], conn: sqlite3.Connection) -> int:
+    """
+    Write already-transformed product rows to the database.
+    
+    Rows are tuples in PRODUCT_COLUMNS order, consumed lazily in
+    SYNC_BATCH_SIZE chunks. They are staged in an in-memory database and
+    land on disk in a single transaction at the end, so a sync either
+    applies in full or not at all. The price is memory: the staging table
+    holds every row of the sync, so a full sync costs O(catalog) memory
+    however the rows are streamed in.
+    
+    Returns:
+        Number of rows written
+    """
+    rows = iter(rows)
+    # iter() with a sentinel pulls batches until the source is exhausted
+    return _write_row_batches(iter(lambda: list(islice(rows, SYNC_BATCH_SIZE)), []), conn)
+
+def _write_row_batches(batches: Iterable[List[tuple]], conn: sqlite3.Connection) -> int:
+    """Stage each batch of rows with one executemany, then copy them all to disk."""
+    cursor = conn.cursor()
+    row_count = 0
+    
+    cursor.execute("ATTACH DATABASE ':memory:' AS stage")
     try:
-        # Get the first variant for price and inventory information
-        variant = product.get('variants', [{}])[0] if product.get('variants') else {}
+        cursor.execute(CREATE_STAGED_PRODUCTS_SQL)
         
-        transformed_data = {
-            'id': product.get('id'),
-            'title': product.get('title'),
-            'description': product.get('body_html'),
-            'vendor': product.get('vendor'),
-            'product_type': product.get('product_type'),
-            'created_at': product.get('created_at'),
-            'updated_at': product.get('updated_at'),
-            'published_at': product.get('published_at'),
-            'status': product.get('status'),
-            'price': float(variant.get('price', 0)) if variant.get('price') else None,
-            'compare_at_price': float(variant.get('compare_at_price', 0)) if variant.get('compare_at_price') else None,
-            'sku': variant.get('sku'),
-            'inventory_quantity': variant.get('inventory_quantity'),
-            'last_synced_at': datetime.utcnow()
-        }
+        for batch in batches:
+            # One executemany call prepares the INSERT once per batch
+            cursor.executemany(STAGE_PRODUCT_SQL, batch)
+            row_count += len(batch)
+        
+        # Copy everything to disk in one transaction; IMMEDIATE takes the
+        # write lock up front so we never have to upgrade a read lock. A
+        # first load into an empty table has nothing to update, so it skips
+        # the conflict resolution entirely.
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM main.products)")
+        cursor.execute(MERGE_STAGED_PRODUCTS_SQL if cursor.fetchone()[0] else COPY_STAGED_PRODUCTS_SQL)
+        conn.commit()
+        return row_count
         
-        logger.debug(f"Successfully transformed product data for ID: {transformed_data['id']}")
-        return transformed_data
     except Exception as e:
-        logger.error(f"Error transforming product data: {str(e)}")
+        logger.error(f"Database error during sync: {str(e)}")
+        conn.rollback()
         raise
+    finally:
+        # Runs after any rollback above; DETACH fails inside a transaction
+        cursor.execute("DETACH DATABASE stage")
 
-def sync_products_to_db(products: List[Dict[Any, Any]], conn: sqlite3.Connection) -> None:
-    """Sync products to the database."""
-    cursor = conn.cursor()
-    current_time = datetime.utcnow()
-    success_count = 0
+class SyncResult(NamedTuple):
+    """Outcome of sync_products_to_db."""
+    synced: int  # products written
+    failed: int  # products skipped because they failed to transform
+
+def sync_products_to_db(products: Iterable[Dict[Any, Any]], conn: sqlite3.Connection) -> SyncResult:
+    """
+    Sync products to the database.
+    
+    Products are transformed a SYNC_BATCH_SIZE batch at a time as they are
+    staged, so a streaming source such as get_all_products keeps downloading
+    while earlier batches are staged. Staging still keeps the whole sync
+    in memory until it is copied to disk. Products that fail to transform
+    are logged and skipped.
+    
+    Returns:
+        SyncResult with the number of products written and skipped
+    """
+    current_time = int(time.time())
     error_count = 0
     
-    try:
-        for product in products:
+    def row_batches() -> Iterator[List[ProductRow]]:
+        nonlocal error_count
+        source = iter(products)
+        for batch in iter(lambda: list(islice(source, SYNC_BATCH_SIZE)), []):
             try:
                 # Transform the product data to match our schema
-                transformed_data = transform_product_data(product)
-                
-                cursor.execute('''
-                    INSERT OR REPLACE INTO products (
-                        id, title, description, vendor, product_type,
-                        created_at, updated_at, published_at, status,
-                        price, compare_at_price, sku, inventory_quantity,
-                        last_synced_at
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    transformed_data['id'],
-                    transformed_data['title'],
-                    transformed_data['description'],
-                    transformed_data['vendor'],
-                    transformed_data['product_type'],
-                    transformed_data['created_at'],
-                    transformed_data['updated_at'],
-                    transformed_data['published_at'],
-                    transformed_data['status'],
-                    transformed_data['price'],
-                    transformed_data['compare_at_price'],
-                    transformed_data['sku'],
-                    transformed_data['inventory_quantity'],
-                    transformed_data['last_synced_at']
-                ))
-                success_count += 1
-                
-            except Exception as e:
-                error_count += 1
-                logger.error(f"Error syncing product {product.get('id', 'unknown')}: {str(e)}")
-                continue
-        
+                yield [transform_product_data(product, current_time) for product in batch]
+            except Exception:
+                # Redo a batch with a bad product one by one to skip just that one
+                rows = []
+                for product in batch:
+                    try:
+                        rows.append(transform_product_data(product, current_time))
+                    except Exception as e:
+                        error_count += 1
+                        logger.error("Error syncing product %s: %s", product.get('id', 'unknown'), e)
+                yield rows
+    
+    success_count = _write_row_batches(row_batches(), conn)
+    logger.info(f"Sync completed. Successfully synced {success_count} products. Failed: {error_count}")
+    return SyncResult(success_count, error_count)
+
+def create_product_indexes(conn: sqlite3.Connection) -> None:
+    """Create any missing secondary indexes on products in one transaction."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        for statement in CREATE_PRODUCT_INDEXES_SQL:
+            cursor.execute(statement)
         conn.commit()
-        logger.info(f"Sync completed. Successfully synced {success_count} products. Failed: {error_count}")
-        
     except Exception as e:
-        logger.error(f"Database error during sync: {str(e)}")
+        logger.error(f"Failed to create product indexes: {str(e)}")
         conn.rollback()
         raise
 
+def get_sync_checkpoint(conn: sqlite3.Connection) -> Optional[str]:
+    """Return the start time of the last successful sync, if there was one."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT last_updated_at FROM sync_state WHERE id = 1")
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def save_sync_checkpoint(conn: sqlite3.Connection, synced_from: str) -> None:
+    """Record the start time of a successful sync for the next incremental run."""
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO sync_state (id, last_updated_at) VALUES (1, ?)
+        ON CONFLICT(id) DO UPDATE SET last_updated_at = excluded.last_updated_at
+    ''', (synced_from,))
+
 def get_product_details(product_id: int) -> Dict[Any, Any]:
     """
     Fetch detailed information about a specific product from Shopify.
@@ -222,12 +686,25 @@ def get_product_details(product_id: int) -> Dict[Any, Any]:
     except Exception as e:
         raise Exception(f"Failed to fetch product details for ID {product_id}: {str(e)}")
 
+def get_db_connection() -> sqlite3.Connection:
+    """
+    Return the process-wide database connection, opening it on first use.
+    
+    Reusing one connection keeps SQLite's page cache warm between syncs and
+    runs the schema setup in init_db only once per process.
+    """
+    global _db_conn
+    with _db_init_lock:
+        if _db_conn is None:
+            _db_conn = init_db()
+        return _db_conn
+
 def trigger_sync():
-    """Trigger the sync process in a background thread."""
+    """Run one full sync; called by the background worker."""
     try:
         # These should be set as environment variables
-        shop_url = os.getenv('SHOPIFY_SHOP_URL')
-        access_token = os.getenv('SHOPIFY_ACCESS_TOKEN')
+        shop_url = CONFIG.shop_url
+        access_token = CONFIG.access_token
         
         if not all([shop_url, access_token]):
             error_msg = "Missing required environment variables: SHOPIFY_SHOP_URL, SHOPIFY_ACCESS_TOKEN"
@@ -239,42 +716,79 @@ def trigger_sync():
         # Initialize Shopify API
         init_shopify(shop_url, access_token)
         
-        # Initialize database
-        conn = init_db()
+        # Reuse the process-wide database connection
+        conn = get_db_connection()
         
-        try:
-            # Fetch products from Shopify
-            products = get_all_products()
-            
-            # Sync products to database
-            sync_products_to_db(products, conn)
-            
-            result = {"status": "success", "message": f"Successfully synced {len(products)} products to database"}
-            logger.info(result["message"])
-            return result
-            
-        finally:
-            conn.close()
-            logger.info("Database connection closed")
+        # Only fetch products changed since the last successful sync. The
+        # next checkpoint is taken before fetching so edits made while this
+        # sync runs are picked up next time.
+        updated_at_min = get_sync_checkpoint(conn)
+        sync_started_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        
+        # Fetch products from Shopify and sync them to the database, one
+        # writer at a time. REST pages are written as they arrive while the
+        # following pages download.
+        if CONFIG.bulk_sync:
+            products = get_all_products_bulk(updated_at_min)
+        else:
+            products = get_all_products(updated_at_min)
+        
+        with _db_write_lock:
+            synced_count, failed_count = sync_products_to_db(products, conn)
+            create_product_indexes(conn)
+            # An incremental fetch never returns a skipped product again
+            # unless it is edited, so only move the checkpoint past a clean
+            # sync; the next run then retries the failed products
+            if failed_count:
+                logger.warning(f"{failed_count} products failed to sync; keeping the previous checkpoint")
+            else:
+                save_sync_checkpoint(conn, sync_started_at)
+        
+        result = {"status": "success", "message": f"Successfully synced {synced_count} products to database"}
+        logger.info(result["message"])
+        return result
             
     except Exception as e:
         error_msg = f"Sync process failed: {str(e)}"
         logger.error(error_msg)
         return {"status": "error", "message": error_msg}
 
+def _run_sync_worker() -> None:
+    """Run queued sync requests one at a time for the life of the process."""
+    while True:
+        _sync_queue.get()
+        try:
+            trigger_sync()
+        finally:
+            _sync_queue.task_done()
+
+def _ensure_sync_worker() -> None:
+    """Start the background sync worker if it isn't running yet."""
+    global _sync_worker
+    with _sync_worker_lock:
+        if _sync_worker is None or not _sync_worker.is_alive():
+            _sync_worker = threading.Thread(target=_run_sync_worker, name='shopify-sync', daemon=True)
+            _sync_worker.start()
+
 @app.route('/sync/trigger', methods=['POST'])
 def sync_trigger():
     """Endpoint to trigger the sync process."""
     try:
-        # Start sync in a background thread
-        thread = threading.Thread(target=trigger_sync)
-        thread.start()
+        # Hand the sync to the background worker
+        _ensure_sync_worker()
+        _sync_queue.put_nowait(True)
         
         logger.info("Sync process initiated via API endpoint")
         return jsonify({
             "status": "started",
             "message": "Sync process has been initiated"
-        })
+        }), 202
+    except queue.Full:
+        logger.info("Sync request rejected: another sync is already waiting to run")
+        return jsonify({
+            "status": "already running",
+            "message": "A sync is already running and another is queued"
+        }), 409
     except Exception as e:
         error_msg = f"Failed to start sync process: {str(e)}"
         logger.error(error_msg)
@@ -284,4 +798,5 @@ def sync_trigger():
         }), 500
 
 if __name__ == "__main__":
+    get_db_connection()
     app.run(host='0.0.0.0', port=5000)
@@ -1,31 +1,111 @@
+"""
+Tests for sync.py.
+
+Each test class opens its own in-memory database, so classes can run in
+parallel: `pytest -n auto test_sync.py` with pytest-xdist installed.
+conftest.py keeps each class on one worker and detaches sync's rotating
+log file, which worker processes can't safely share.
+"""
 import os
+import json
+import queue
+import time
+import itertools
+import types
 import unittest
 import sqlite3
-from unittest.mock import patch, MagicMock
-from datetime import datetime
+import tempfile
+from unittest.mock import patch, MagicMock, ANY
+from pyactiveresource import formats
+from pyactiveresource.connection import ClientError
+import shopify
+import sync
 from sync import (
     init_shopify,
     get_all_products,
+    get_all_products_bulk,
     init_db,
     transform_product_data,
     sync_products_to_db,
-    trigger_sync
+    sync_rows_to_db,
+    trigger_sync,
+    create_product_indexes,
+    get_sync_checkpoint,
+    save_sync_checkpoint,
+    app,
+    PRODUCT_COLUMNS,
+    SYNC_BATCH_SIZE,
+    BULK_DOWNLOAD_TIMEOUT,
+    ShopifyConfig
 )
 
-class TestShopifySync(unittest.TestCase):
-    def setUp(self):
-        """Set up test environment before each test."""
-        # Set test environment variables
-        os.environ['SHOPIFY_SHOP_URL'] = 'test-shop.myshopify.com'
-        os.environ['SHOPIFY_ACCESS_TOKEN'] = 'test-token'
-        os.environ['SHOPIFY_API_KEY'] = 'test-api-key'
-        os.environ['SHOPIFY_API_SECRET'] = 'test-api-secret'
-        
-        # Use in-memory SQLite database for tests
-        self.db_path = ':memory:'
+TEST_CONFIG = ShopifyConfig(
+    shop_url='test-shop.myshopify.com',
+    access_token='test-token',
+    api_key='test-api-key',
+    api_secret='test-api-secret'
+)
+
+def as_resource(product):
+    """Wrap a product dict the way shopify.Product.find hands it back."""
+    resource = MagicMock(spec=shopify.Product)
+    resource.to_dict.return_value = product
+    return resource
+
+class RecordingConnection:
+    """Wrap a sqlite3 connection and log what its cursors are asked to run."""
+    def __init__(self, conn):
+        self._conn = conn
+        self.calls = []
+
+    def cursor(self):
+        return RecordingCursor(self._conn.cursor(), self.calls)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+class RecordingCursor:
+    """Cursor proxy appending (method, sql, row count) to a shared call log."""
+    def __init__(self, cursor, calls):
+        self._cursor = cursor
+        self._calls = calls
+
+    def execute(self, sql, parameters=()):
+        self._calls.append(('execute', sql, 1))
+        return self._cursor.execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        rows = list(seq_of_parameters)
+        self._calls.append(('executemany', sql, len(rows)))
+        return self._cursor.executemany(sql, rows)
+
+    def executescript(self, sql_script):
+        self._calls.append(('executescript', sql_script, 0))
+        return self._cursor.executescript(sql_script)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class ShopifySyncTestCase(unittest.TestCase):
+    """Base class giving each test class its own database and sample product."""
+    @classmethod
+    def setUpClass(cls):
+        """Set up state shared by every test in the class."""
+        # One in-memory SQLite database for the whole class; tearDown empties
+        # it, which is far cheaper than opening and migrating a new one
+        cls.db_path = ':memory:'
+        cls.conn = init_db(cls.db_path)
+        cls.conn.row_factory = sqlite3.Row  # assert on columns by name
         
-        # Sample Shopify product data
-        self.sample_product = {
+        # Sample Shopify product data, built once and read-only so no test
+        # can leak edits into the next; tests that need a variant copy it
+        cls.sample_product = types.MappingProxyType({
             'id': 123456789,
             'title': 'Test Product',
             'body_html': '<p>Test Description</p>',
@@ -35,7 +115,7 @@ class TestShopifySync(unittest.TestCase):
             'updated_at': '2024-03-14T11:00:00Z',
             'published_at': '2024-03-14T12:00:00Z',
             'status': 'active',
-            'variants': [{
+            'variants': (types.MappingProxyType({
                 'id': 987654321,
                 'title': 'Default Title',
                 'price': '19.99',
@@ -44,63 +124,226 @@ class TestShopifySync(unittest.TestCase):
                 'inventory_quantity': 100,
                 'weight': 1.0,
                 'weight_unit': 'kg'
-            }]
-        }
+            }),)
+        })
+
+    @classmethod
+    def tearDownClass(cls):
+        """Clean up after all tests have run."""
+        cls.conn.close()
 
     def tearDown(self):
         """Clean up after each test."""
-        # Clear environment variables
-        for key in ['SHOPIFY_SHOP_URL', 'SHOPIFY_ACCESS_TOKEN', 'SHOPIFY_API_KEY', 'SHOPIFY_API_SECRET']:
-            if key in os.environ:
-                del os.environ[key]
-
-    @patch('shopify.Session.setup')
-    @patch('shopify.Session')
-    @patch('shopify.ShopifyResource.activate_session')
-    def test_init_shopify(self, mock_activate_session, mock_session, mock_setup):
+        # Empty the shared database for the next test
+        self.conn.execute("DELETE FROM products")
+        self.conn.execute("DELETE FROM sync_state")
+
+@patch('sync.CONFIG', TEST_CONFIG)
+class TestShopifyApi(ShopifySyncTestCase):
+    def test_init_shopify(self):
         """Test Shopify API initialization."""
         # Arrange
         shop_url = 'test-shop.myshopify.com'
         access_token = 'test-token'
+        calls = []
+        def client_factory(*args):
+            calls.append(args)
+            return types.SimpleNamespace(
+                site=f'https://{shop_url}/admin', url=shop_url, token=access_token,
+                api_version=types.SimpleNamespace(name='2024-01')
+            )
+        self.addCleanup(shopify.ShopifyResource.clear_session)
+        self.addCleanup(shopify.Session.setup, api_key=shopify.Session.api_key, secret=shopify.Session.secret)
+        # init_shopify swaps the REST decoder process-wide; put the stock one
+        # back so other test classes see the library's default
+        self.addCleanup(setattr, formats.JSONFormat, 'decode', formats.JSONFormat.__dict__['decode'])
         
         # Act
-        init_shopify(shop_url, access_token)
+        init_shopify(shop_url, access_token, client_factory=client_factory)
         
         # Assert
-        mock_setup.assert_called_once_with(api_key='test-api-key', secret='test-api-secret')
-        mock_session.assert_called_once_with(shop_url, '2024-01', access_token)
-        mock_activate_session.assert_called_once()
+        self.assertEqual(calls, [(shop_url, '2024-01', access_token)])
+        self.assertEqual((shopify.Session.api_key, shopify.Session.secret), ('test-api-key', 'test-api-secret'))
+        self.assertEqual(shopify.ShopifyResource.get_headers()['X-Shopify-Access-Token'], access_token)
+        self.assertIn(shop_url, shopify.ShopifyResource.get_site())
+        if sync.orjson:
+            self.assertIs(formats.JSONFormat.decode, sync._orjson_decode)
+        self.assertEqual(formats.JSONFormat.decode(b'{"products": [{"id": 1}]}'), [{'id': 1}])
 
+    @patch('sync.PAGE_SIZE', 1)
     @patch('shopify.Product.find')
     def test_get_all_products(self, mock_product_find):
         """Test fetching all products from Shopify."""
         # Arrange
+        second_product = dict(self.sample_product, id=self.sample_product['id'] + 1)
         mock_product_find.side_effect = [
-            [self.sample_product],  # First page
-            []  # Second page (empty)
+            [as_resource(self.sample_product)],  # First page
+            [as_resource(second_product)],  # Second page
+            []  # Third page (empty)
         ]
         
+        # Act
+        products = list(get_all_products())
+        
+        # Assert
+        self.assertEqual([product['id'] for product in products], [self.sample_product['id'], second_product['id']])
+        # REST cursor paging: each request continues from the last id of the
+        # page before it instead of an offset page number
+        self.assertEqual([c.kwargs for c in mock_product_find.call_args_list], [
+            {'limit': 1, 'since_id': 0},
+            {'limit': 1, 'since_id': self.sample_product['id']},
+            {'limit': 1, 'since_id': second_product['id']}
+        ])
+
+    @patch('sync.PAGE_SIZE', 1)
+    @patch('shopify.Product.find')
+    def test_get_all_products_streams_pages(self, mock_product_find):
+        """Test that products are yielded as pages arrive, not after the whole catalog."""
+        # Arrange
+        mock_product_find.side_effect = [
+            [as_resource(dict(self.sample_product, id=product_id))] for product_id in range(1, 6)
+        ] + [[]]
+        
         # Act
         products = get_all_products()
+        first = next(products)
+        fetched_before_consuming = mock_product_find.call_count
+        products.close()
+        
+        # Assert
+        self.assertEqual(first['id'], 1)
+        # The first page, plus at most the one page fetched ahead; closing
+        # early must not crawl the rest of the catalog
+        self.assertIn(fetched_before_consuming, (1, 2))
+        self.assertLessEqual(mock_product_find.call_count, 2)
+
+    @patch('shopify.Product.find')
+    def test_get_all_products_since_checkpoint(self, mock_product_find):
+        """Test that an incremental fetch filters by updated_at_min."""
+        # Arrange
+        mock_product_find.return_value = [as_resource(self.sample_product)]
+        
+        # Act
+        products = list(get_all_products('2024-03-14T00:00:00+00:00'))
         
         # Assert
         self.assertEqual(len(products), 1)
-        self.assertEqual(products[0]['id'], self.sample_product['id'])
-        mock_product_find.assert_called()
+        mock_product_find.assert_called_once_with(limit=250, since_id=0, updated_at_min='2024-03-14T00:00:00+00:00')
 
-    def test_init_db(self):
-        """Test database initialization."""
+    @patch('sync.time.sleep')
+    @patch('shopify.Product.find')
+    def test_get_all_products_retries_rate_limited_page(self, mock_product_find, mock_sleep):
+        """Test that a 429 from Shopify is retried after the Retry-After delay."""
+        # Arrange
+        rate_limited = MagicMock(code=429, headers={'Retry-After': '2.0'}, msg='Too Many Requests', url='')
+        rate_limited.read.return_value = b''
+        mock_product_find.side_effect = [ClientError(rate_limited), [as_resource(self.sample_product)]]
+        
         # Act
-        conn = init_db(self.db_path)
+        products = list(get_all_products())
         
         # Assert
-        cursor = conn.cursor()
+        self.assertEqual(len(products), 1)
+        self.assertEqual(mock_product_find.call_count, 2)
+        mock_sleep.assert_called_once_with(2.0)
+
+    @patch('sync.time.sleep')
+    @patch('sync.urllib.request.urlopen')
+    @patch('shopify.GraphQL')
+    def test_get_all_products_bulk(self, mock_graphql, mock_urlopen, mock_sleep):
+        """Test fetching all products through a GraphQL bulk operation."""
+        # Arrange
+        mock_graphql.return_value.execute.side_effect = [
+            json.dumps({'data': {'bulkOperationRunQuery': {
+                'bulkOperation': {'id': 'gid://shopify/BulkOperation/1', 'status': 'CREATED'},
+                'userErrors': []
+            }}}),
+            json.dumps({'data': {'currentBulkOperation': {
+                'id': 'gid://shopify/BulkOperation/1', 'status': 'RUNNING', 'errorCode': None, 'url': None
+            }}}),
+            json.dumps({'data': {'currentBulkOperation': {
+                'id': 'gid://shopify/BulkOperation/1', 'status': 'COMPLETED', 'errorCode': None,
+                'url': 'https://storage.example.com/bulk.jsonl'
+            }}})
+        ]
+        variant = self.sample_product['variants'][0]
+        mock_urlopen.return_value.__enter__.return_value = [
+            json.dumps({
+                'id': 'gid://shopify/Product/123456789',
+                'title': 'Test Product',
+                'bodyHtml': '<p>Test Description</p>',
+                'vendor': 'Test Vendor',
+                'productType': 'Test Type',
+                'createdAt': '2024-03-14T10:00:00Z',
+                'updatedAt': '2024-03-14T11:00:00Z',
+                'publishedAt': '2024-03-14T12:00:00Z',
+                'status': 'ACTIVE'
+            }).encode(),
+            json.dumps({
+                'price': variant['price'],
+                'compareAtPrice': variant['compare_at_price'],
+                'sku': variant['sku'],
+                'inventoryQuantity': variant['inventory_quantity'],
+                '__parentId': 'gid://shopify/Product/123456789'
+            }).encode()
+        ]
+        
+        # Act
+        products = get_all_products_bulk()
+        
+        # Assert
+        self.assertEqual(len(products), 1)
+        self.assertEqual(mock_sleep.call_count, 2)
+        mock_urlopen.assert_called_once_with('https://storage.example.com/bulk.jsonl', timeout=BULK_DOWNLOAD_TIMEOUT)
+        self.assertEqual(
+            transform_product_data(products[0]),
+            transform_product_data(self.sample_product)._replace(last_synced_at=ANY)
+        )
+
+    @patch('sync.BULK_MAX_WAIT', 0)
+    @patch('sync.time.sleep')
+    @patch('sync.urllib.request.urlopen')
+    @patch('shopify.GraphQL')
+    def test_get_all_products_bulk_gives_up_after_max_wait(self, mock_graphql, mock_urlopen, mock_sleep):
+        """Test that a bulk operation that never finishes is cancelled instead of polled forever."""
+        # Arrange
+        mock_graphql.return_value.execute.side_effect = [
+            json.dumps({'data': {'bulkOperationRunQuery': {
+                'bulkOperation': {'id': 'gid://shopify/BulkOperation/1', 'status': 'CREATED'},
+                'userErrors': []
+            }}}),
+            json.dumps({'data': {'currentBulkOperation': {
+                'id': 'gid://shopify/BulkOperation/1', 'status': 'RUNNING', 'errorCode': None, 'url': None
+            }}}),
+            json.dumps({'data': {'bulkOperationCancel': {'userErrors': []}}})
+        ]
+        
+        # Act / Assert
+        with self.assertRaises(TimeoutError):
+            get_all_products_bulk()
+        cancel_query, cancel_variables = mock_graphql.return_value.execute.call_args.args
+        self.assertIn('bulkOperationCancel', cancel_query)
+        self.assertEqual(cancel_variables, {'id': 'gid://shopify/BulkOperation/1'})
+        mock_urlopen.assert_not_called()
+
+    def test_config_parses_bulk_sync_flag(self):
+        """Test that SHOPIFY_BULK_SYNC only turns bulk sync on for truthy values."""
+        for value, expected in [('1', True), ('true', True), ('Yes', True),
+                                ('0', False), ('false', False), ('off', False), ('', False)]:
+            with self.subTest(value=value), patch.dict('os.environ', {'SHOPIFY_BULK_SYNC': value}):
+                self.assertIs(ShopifyConfig.from_env().bulk_sync, expected)
+
+class TestDatabase(ShopifySyncTestCase):
+    def test_init_db(self):
+        """Test database initialization."""
+        # Assert
+        cursor = self.conn.cursor()
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='products'")
         self.assertIsNotNone(cursor.fetchone())
         
         # Check table schema
         cursor.execute("PRAGMA table_info(products)")
-        columns = {row[1] for row in cursor.fetchall()}
+        columns = {row['name'] for row in cursor.fetchall()}
         expected_columns = {
             'id', 'title', 'description', 'vendor', 'product_type',
             'created_at', 'updated_at', 'published_at', 'status',
@@ -109,96 +352,393 @@ class TestShopifySync(unittest.TestCase):
         }
         self.assertEqual(columns, expected_columns)
         
-        conn.close()
+        # id is the rowid (INTEGER PRIMARY KEY), so lookups by id need no
+        # separate index; updated_at gets one for incremental filters
+        cursor.execute("PRAGMA table_info(products)")
+        primary_keys = [row['name'] for row in cursor.fetchall() if row['pk']]
+        self.assertEqual(primary_keys, ['id'])
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='products'")
+        names = {row['name'] for row in cursor.fetchall()}
+        self.assertIn('ix_products_updated_at', names)
+        plan = cursor.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM products WHERE updated_at > ?", (0,)
+        ).fetchall()
+        self.assertIn('ix_products_updated_at', ' '.join(row['detail'] for row in plan))
+
+    def test_init_db_runs_schema_as_one_script(self):
+        """Test that init_db sends its settings and schema to SQLite in one call."""
+        # Arrange
+        connect = sqlite3.connect
+        recorded = []
+        def recording_connect(*args, **kwargs):
+            recorded.append(RecordingConnection(connect(*args, **kwargs)))
+            return recorded[-1]
+        
+        # Act
+        with patch('sync.sqlite3.connect', recording_connect):
+            conn = init_db(':memory:')
+        self.addCleanup(conn.close)
+        
+        # Assert
+        calls = recorded[0].calls
+        self.assertLessEqual(len(calls), 2)
+        self.assertIn('executescript', [method for method, sql, rows in calls])
+        self.assertEqual(
+            {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")},
+            {'products', 'sync_state'}
+        )
+
+    def test_init_db_manual_transactions(self):
+        """Test that init_db hands back an autocommit connection for explicit transactions."""
+        # Arrange: with the default isolation_level, sqlite3 would silently
+        # BEGIN before DML and fight the writers' own BEGIN IMMEDIATE
+        self.assertIsNone(self.conn.isolation_level)
+        rows = [(product_id, f'Product {product_id}') for product_id in range(1, 4)]
+        
+        # Act
+        self.conn.execute("BEGIN")
+        self.conn.executemany("INSERT INTO products (id, title) VALUES (?, ?)", rows)
+        in_transaction = self.conn.in_transaction
+        self.conn.execute("COMMIT")
+        
+        # Assert
+        self.assertTrue(in_transaction)
+        self.assertFalse(self.conn.in_transaction)
+        self.assertEqual([tuple(row) for row in self.conn.execute("SELECT id, title FROM products ORDER BY id")], rows)
+
+    def test_init_db_sets_fast_pragmas(self):
+        """Test that init_db leaves SQLite's safe-and-slow defaults behind."""
+        # Arrange: a file-backed database, since SQLite reports journal_mode
+        # 'memory' for :memory: whatever the PRAGMA asked for
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        conn = init_db(os.path.join(tmp_dir.name, 'products.db'))
+        self.addCleanup(conn.close)
+        
+        # Act
+        cursor = conn.cursor()
+        journal_mode = cursor.execute("PRAGMA journal_mode").fetchone()[0]
+        synchronous = cursor.execute("PRAGMA synchronous").fetchone()[0]
+        temp_store = cursor.execute("PRAGMA temp_store").fetchone()[0]
+        cache_size = cursor.execute("PRAGMA cache_size").fetchone()[0]
+        
+        # Assert
+        self.assertEqual(journal_mode, 'wal')
+        self.assertEqual(synchronous, 1)  # NORMAL
+        self.assertEqual(temp_store, 2)  # MEMORY
+        self.assertLessEqual(cache_size, -65536)  # negative means KiB, so >= 64 MB
 
+class TestTransform(ShopifySyncTestCase):
     def test_transform_product_data(self):
-        """Test product data transformation."""
+        """Test product data transformation, with and without optional fields."""
+        # Arrange
+        synced_at = 1710495000
+        incomplete_product = {
+            'id': 123456789,
+            'title': 'Test Product',
+            # Missing other fields
+        }
+        CASES = [
+            ('full', self.sample_product, {
+                'id': 123456789,
+                'title': 'Test Product',
+                'description': '<p>Test Description</p>',
+                'vendor': 'Test Vendor',
+                'product_type': 'Test Type',
+                'created_at': 1710410400,
+                'updated_at': 1710414000,
+                'published_at': 1710417600,
+                'status': 'active',
+                'price': 19.99,
+                'compare_at_price': 24.99,
+                'sku': 'TEST-SKU-123',
+                'inventory_quantity': 100,
+                'last_synced_at': synced_at
+            }),
+            ('missing_fields', incomplete_product, dict(
+                dict.fromkeys(PRODUCT_COLUMNS),
+                id=123456789,
+                title='Test Product',
+                last_synced_at=synced_at
+            )),
+        ]
+        
+        for name, product, expected in CASES:
+            with self.subTest(name=name):
+                # Act
+                transformed_data = transform_product_data(product, synced_at)
+                
+                # Assert
+                self.assertEqual(transformed_data._fields, PRODUCT_COLUMNS)
+                self.assertEqual(transformed_data._asdict(), expected)
+
+    def test_transform_returns_tuple_for_executemany(self):
+        """Test that a transformed product is a tuple in the table's column order."""
         # Act
-        transformed_data = transform_product_data(self.sample_product)
+        row = transform_product_data(self.sample_product, 1710495000)
+        table_columns = tuple(column['name'] for column in self.conn.execute("PRAGMA table_info(products)"))
         
         # Assert
-        self.assertEqual(transformed_data['id'], self.sample_product['id'])
-        self.assertEqual(transformed_data['title'], self.sample_product['title'])
-        self.assertEqual(transformed_data['description'], self.sample_product['body_html'])
-        self.assertEqual(transformed_data['vendor'], self.sample_product['vendor'])
-        self.assertEqual(transformed_data['product_type'], self.sample_product['product_type'])
-        self.assertEqual(transformed_data['status'], self.sample_product['status'])
-        self.assertEqual(float(transformed_data['price']), float(self.sample_product['variants'][0]['price']))
-        self.assertEqual(float(transformed_data['compare_at_price']), float(self.sample_product['variants'][0]['compare_at_price']))
-        self.assertEqual(transformed_data['sku'], self.sample_product['variants'][0]['sku'])
-        self.assertEqual(transformed_data['inventory_quantity'], self.sample_product['variants'][0]['inventory_quantity'])
+        self.assertIsInstance(row, tuple)
+        self.assertEqual(row._fields, table_columns)
+        self.assertEqual(row.price, 19.99)
+        self.assertEqual(row.last_synced_at, 1710495000)
+        # An explicit sync time is kept even when it is falsy
+        self.assertEqual(transform_product_data(self.sample_product, 0).last_synced_at, 0)
 
+class TestSyncToDatabase(ShopifySyncTestCase):
     def test_sync_products_to_db(self):
         """Test syncing products to database."""
         # Arrange
-        conn = init_db(self.db_path)
         products = [self.sample_product]
         
         # Act
-        sync_products_to_db(products, conn)
+        sync_products_to_db(products, self.conn)
         
         # Assert
-        cursor = conn.cursor()
+        cursor = self.conn.cursor()
         cursor.execute("SELECT * FROM products WHERE id = ?", (self.sample_product['id'],))
         row = cursor.fetchone()
         
-        self.assertIsNotNone(row)
-        self.assertEqual(row[0], self.sample_product['id'])  # id
-        self.assertEqual(row[1], self.sample_product['title'])  # title
-        self.assertEqual(row[2], self.sample_product['body_html'])  # description
-        self.assertEqual(row[3], self.sample_product['vendor'])  # vendor
-        self.assertEqual(row[4], self.sample_product['product_type'])  # product_type
-        self.assertEqual(float(row[9]), float(self.sample_product['variants'][0]['price']))  # price
-        self.assertEqual(float(row[10]), float(self.sample_product['variants'][0]['compare_at_price']))  # compare_at_price
-        self.assertEqual(row[11], self.sample_product['variants'][0]['sku'])  # sku
-        self.assertEqual(row[12], self.sample_product['variants'][0]['inventory_quantity'])  # inventory_quantity
+        self.assertIsInstance(row, sqlite3.Row)
+        self.assertEqual(tuple(row.keys()), PRODUCT_COLUMNS)
+        self.assertEqual(row['id'], self.sample_product['id'])
+        self.assertEqual(row['title'], self.sample_product['title'])
+        self.assertEqual(row['description'], self.sample_product['body_html'])
+        self.assertEqual(row['vendor'], self.sample_product['vendor'])
+        self.assertEqual(row['product_type'], self.sample_product['product_type'])
+        self.assertEqual(row['price'], float(self.sample_product['variants'][0]['price']))
+        self.assertEqual(row['compare_at_price'], float(self.sample_product['variants'][0]['compare_at_price']))
+        self.assertEqual(row['sku'], self.sample_product['variants'][0]['sku'])
+        self.assertEqual(row['inventory_quantity'], self.sample_product['variants'][0]['inventory_quantity'])
+        self.assertIsInstance(row['last_synced_at'], int)
+
+    def test_sync_products_to_db_batches_writes(self):
+        """Test that a large sync binds rows with executemany and commits once."""
+        # Arrange
+        products = [dict(self.sample_product, id=product_id) for product_id in range(1, 10_001)]
+        conn = RecordingConnection(self.conn)
+        statements = []
+        self.conn.set_trace_callback(statements.append)
+        self.addCleanup(self.conn.set_trace_callback, None)
+        
+        # Act
+        synced, failed = sync_products_to_db(products, conn)
+        
+        # Assert
+        self.assertEqual(synced, 10_000)
+        self.assertEqual(failed, 0)
+        self.assertEqual(sum(1 for sql in statements if sql.startswith('BEGIN')), 1)
+        self.assertEqual(statements.count('COMMIT'), 1)
+        bound_rows = sum(rows for method, sql, rows in conn.calls
+                         if method == 'executemany' and 'INSERT' in sql)
+        self.assertEqual(bound_rows, 10_000)
+        # The only INSERT run through execute is the set-based copy to disk
+        row_inserts = [sql for method, sql, rows in conn.calls
+                       if method == 'execute' and 'INSERT' in sql and 'VALUES' in sql]
+        self.assertEqual(row_inserts, [])
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM products").fetchone()[0], 10_000)
+
+    @unittest.skipUnless(os.environ.get('RUN_PERF_TESTS'), "set RUN_PERF_TESTS=1 to run benchmarks")
+    def test_sync_10k_products_under_budget(self):
+        """Benchmark: 10,000 rows must sync into :memory: well within 2 seconds."""
+        # Arrange: one column per field, zipped into rows only as they are
+        # written, so the benchmark doesn't measure building 10,000 dicts
+        rows = zip(
+            range(1, 10_001),  # id
+            itertools.repeat('Test Product'),  # title
+            itertools.repeat('<p>Test Description</p>'),  # description
+            itertools.repeat('Test Vendor'),  # vendor
+            itertools.repeat('Test Type'),  # product_type
+            itertools.repeat(1710410400),  # created_at
+            itertools.repeat(1710414000),  # updated_at
+            itertools.repeat(1710417600),  # published_at
+            itertools.repeat('active'),  # status
+            itertools.repeat(19.99),  # price
+            itertools.repeat(24.99),  # compare_at_price
+            itertools.repeat('TEST-SKU-123'),  # sku
+            itertools.repeat(100),  # inventory_quantity
+            itertools.repeat(1710495000)  # last_synced_at
+        )
+        
+        # Act
+        started = time.perf_counter()
+        synced = sync_rows_to_db(rows, self.conn)
+        elapsed = time.perf_counter() - started
+        
+        # Assert
+        self.assertEqual(synced, 10_000)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM products").fetchone()[0], 10_000)
+        self.assertLess(elapsed, 2.0)
+
+    def test_sync_products_to_db_reuses_one_prepared_insert(self):
+        """Test that a batch is bound to one prepared INSERT with a single executemany."""
+        # Arrange
+        products = [dict(self.sample_product, id=product_id) for product_id in range(1, SYNC_BATCH_SIZE + 1)]
+        conn = RecordingConnection(self.conn)
+        
+        # Act
+        sync_products_to_db(products, conn)
+        
+        # Assert
+        inserts = [(method, sql, rows) for method, sql, rows in conn.calls
+                   if 'INSERT' in sql and 'VALUES' in sql]
+        self.assertEqual(len(inserts), 1)
+        method, sql, rows = inserts[0]
+        self.assertEqual(method, 'executemany')
+        self.assertEqual(rows, len(products))
+
+    def test_sync_products_to_db_skips_malformed_products(self):
+        """Test that a product that fails to transform doesn't sink the rest of its batch."""
+        # Arrange
+        products = [
+            dict(self.sample_product, id=1),
+            dict(self.sample_product, id=2, created_at='not a timestamp'),
+            dict(self.sample_product, id=3)
+        ]
+        
+        # Act
+        with self.assertLogs('sync', level='ERROR') as logs:
+            synced, failed = sync_products_to_db(products, self.conn)
+        
+        # Assert
+        self.assertEqual(synced, 2)
+        self.assertEqual(failed, 1)
+        # The bad product is reported once, not once per transform attempt
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('Error syncing product 2', logs.output[0])
+        self.assertEqual([row['id'] for row in self.conn.execute("SELECT id FROM products ORDER BY id")], [1, 3])
+
+    def test_sync_is_idempotent(self):
+        """Test that re-syncing a product upserts it instead of failing on its id."""
+        # Arrange
+        updated_product = dict(self.sample_product, title='Updated', updated_at='2024-03-15T08:00:00Z')
         
-        conn.close()
+        # Act
+        sync_products_to_db([self.sample_product], self.conn)
+        sync_products_to_db([updated_product], self.conn)
+        
+        # Assert
+        row = self.conn.execute(
+            "SELECT title, updated_at FROM products WHERE id = ?", (self.sample_product['id'],)
+        ).fetchone()
+        self.assertEqual(row['title'], 'Updated')
+        self.assertEqual(row['updated_at'], 1710489600)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM products").fetchone()[0], 1)
 
+    def test_sync_products_to_db_skips_unchanged_products(self):
+        """Test that a re-sync only rewrites products whose updated_at changed."""
+        # Arrange
+        sync_products_to_db([self.sample_product], self.conn)
+        stale_edit = dict(self.sample_product, title='Stale Title')
+        real_edit = dict(self.sample_product, title='New Title', updated_at='2024-03-15T08:00:00Z')
+        
+        # Act
+        sync_products_to_db([stale_edit], self.conn)
+        title_after_stale_edit = self.conn.execute("SELECT title FROM products").fetchone()[0]
+        sync_products_to_db([real_edit], self.conn)
+        title_after_real_edit = self.conn.execute("SELECT title FROM products").fetchone()[0]
+        
+        # Assert
+        self.assertEqual(title_after_stale_edit, self.sample_product['title'])
+        self.assertEqual(title_after_real_edit, 'New Title')
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM products").fetchone()[0], 1)
+
+    def test_create_product_indexes(self):
+        """Test that secondary indexes are created after a sync."""
+        # Arrange
+        sync_products_to_db([self.sample_product], self.conn)
+        
+        # Act
+        create_product_indexes(self.conn)
+        create_product_indexes(self.conn)
+        
+        # Assert
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='products'")
+        names = {row['name'] for row in cursor.fetchall()}
+        self.assertTrue({
+            'ix_products_vendor', 'ix_products_product_type',
+            'ix_products_sku', 'ix_products_updated_at'
+        } <= names)
+
+    def test_sync_checkpoint(self):
+        """Test saving and reading the incremental sync checkpoint."""
+        # Act
+        initial = get_sync_checkpoint(self.conn)
+        save_sync_checkpoint(self.conn, '2024-03-14T10:00:00+00:00')
+        save_sync_checkpoint(self.conn, '2024-03-15T10:00:00+00:00')
+        
+        # Assert
+        self.assertIsNone(initial)
+        self.assertEqual(get_sync_checkpoint(self.conn), '2024-03-15T10:00:00+00:00')
+
+@patch('sync.CONFIG', TEST_CONFIG)
+class TestTriggerSync(ShopifySyncTestCase):
+    @patch('sync._db_conn', None)
     @patch('sync.init_shopify')
     @patch('sync.get_all_products')
     @patch('sync.init_db')
-    @patch('sync.sync_products_to_db')
-    def test_trigger_sync(self, mock_sync_products, mock_init_db, mock_get_products, mock_init_shopify):
+    def test_trigger_sync(self, mock_init_db, mock_get_products, mock_init_shopify):
         """Test the complete sync trigger process."""
         # Arrange
-        mock_get_products.return_value = [self.sample_product]
-        mock_conn = MagicMock()
-        mock_init_db.return_value = mock_conn
+        mock_get_products.side_effect = lambda updated_at_min: iter([self.sample_product])
+        mock_init_db.return_value = self.conn
         
         # Act
         result = trigger_sync()
+        second_result = trigger_sync()
         
         # Assert
         self.assertEqual(result['status'], 'success')
-        mock_init_shopify.assert_called_once()
-        mock_get_products.assert_called_once()
+        self.assertEqual(result['message'], 'Successfully synced 1 products to database')
+        self.assertEqual(second_result['status'], 'success')
+        self.assertEqual(mock_init_shopify.call_count, 2)
+        self.assertEqual(mock_get_products.call_count, 2)
         mock_init_db.assert_called_once()
-        mock_sync_products.assert_called_once_with([self.sample_product], mock_conn)
-        mock_conn.close.assert_called_once()
+        # The second run resumes from the checkpoint the first one saved
+        self.assertIsNone(mock_get_products.call_args_list[0].args[0])
+        self.assertEqual(mock_get_products.call_args_list[1].args[0], get_sync_checkpoint(self.conn))
+        # Querying also proves trigger_sync left the shared connection open
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM products").fetchone()[0], 1)
 
-    def test_transform_product_data_with_missing_fields(self):
-        """Test product data transformation with missing fields."""
+    @patch('sync._db_conn', None)
+    @patch('sync.init_shopify')
+    @patch('sync.get_all_products')
+    @patch('sync.init_db')
+    def test_trigger_sync_keeps_checkpoint_when_products_fail(self, mock_init_db, mock_get_products, mock_init_shopify):
+        """Test that a sync with skipped products doesn't move the checkpoint past them."""
         # Arrange
-        incomplete_product = {
-            'id': 123456789,
-            'title': 'Test Product',
-            # Missing other fields
-        }
+        save_sync_checkpoint(self.conn, '2024-03-14T00:00:00+00:00')
+        malformed_product = dict(self.sample_product, id=2, created_at='not a timestamp')
+        mock_get_products.side_effect = lambda updated_at_min: iter([self.sample_product, malformed_product])
+        mock_init_db.return_value = self.conn
         
         # Act
-        transformed_data = transform_product_data(incomplete_product)
+        result = trigger_sync()
         
         # Assert
-        self.assertEqual(transformed_data['id'], incomplete_product['id'])
-        self.assertEqual(transformed_data['title'], incomplete_product['title'])
-        self.assertIsNone(transformed_data['description'])
-        self.assertIsNone(transformed_data['vendor'])
-        self.assertIsNone(transformed_data['product_type'])
-        self.assertIsNone(transformed_data['price'])
-        self.assertIsNone(transformed_data['compare_at_price'])
-        self.assertIsNone(transformed_data['sku'])
-        self.assertIsNone(transformed_data['inventory_quantity'])
+        self.assertEqual(result['status'], 'success')
+        self.assertEqual(result['message'], 'Successfully synced 1 products to database')
+        self.assertEqual(get_sync_checkpoint(self.conn), '2024-03-14T00:00:00+00:00')
+
+    @patch('sync._ensure_sync_worker')
+    def test_sync_trigger_endpoint(self, mock_ensure_worker):
+        """Test that the endpoint queues one sync and rejects extra requests."""
+        # Arrange
+        client = app.test_client()
+        
+        with patch('sync._sync_queue', queue.Queue(maxsize=1)) as sync_queue:
+            # Act
+            first = client.post('/sync/trigger')
+            second = client.post('/sync/trigger')
+            
+            # Assert
+            self.assertEqual(first.status_code, 202)
+            self.assertEqual(second.status_code, 409)
+            self.assertEqual(second.get_json()['status'], 'already running')
+            self.assertEqual(sync_queue.qsize(), 1)
+            self.assertEqual(mock_ensure_worker.call_count, 2)
 
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file